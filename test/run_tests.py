@@ -4,6 +4,10 @@ import_short_test()
 
 test_GTR()
 
+test_state_pair()
+
+test_prob_t_profiles()
+
 test_ancestral()
 
 test_seq_joint_reconstruction_correct()
@@ -27,6 +27,55 @@ def test_GTR():
         assert np.abs(myGTR.v.sum()) > 1e-10 # **and** v is not zero
 
 
+def test_state_pair():
+    from treetime import GTR
+    import numpy as np
+    myGTR = GTR.standard('Jukes-Cantor', alphabet='nuc')
+    seq_p = np.array(list('ACGT-ACGTNAAAC'))
+    seq_ch = np.array(list('ACGAACC-TAAANC'))
+    multiplicity = np.arange(1, len(seq_p)+1, dtype=float)
+    for ignore_gaps in [True, False]:
+        print('testing state pairs, ignore_gaps:', ignore_gaps)
+        seq_pair, pair_mult = myGTR.state_pair(seq_p, seq_ch, pattern_multiplicity=multiplicity,
+                                               ignore_gaps=ignore_gaps)
+        # brute force count of all pairs of characters in the alphabet
+        expected = {}
+        for a, b, m in zip(seq_p, seq_ch, multiplicity):
+            if a not in myGTR.state_index or b not in myGTR.state_index:
+                continue
+            if ignore_gaps and '-' in (a, b):
+                continue
+            key = (myGTR.state_index[a], myGTR.state_index[b])
+            expected[key] = expected.get(key, 0) + m
+        assert {tuple(p):m for p, m in zip(seq_pair, pair_mult)} == expected
+
+
+def test_prob_t_profiles():
+    from treetime import GTR
+    from treetime.seq_utils import normalize_profile
+    import numpy as np
+    np.random.seed(123)
+    myGTR = GTR.custom(alphabet = np.array(['A', 'C', 'G', 'T', '-']), pi = np.array([0.3, 0.2, 0.2, 0.25, 0.05]),
+                       W=np.ones((5,5)))
+    profile_p = normalize_profile(np.random.random((100,5))**4)[0]
+    profile_ch = normalize_profile(np.random.random((100,5))**4)[0]
+    multiplicity = np.random.randint(1, 5, size=100).astype(float)
+    t_grid = np.array([0.001, 0.01, 0.1, 1.0])
+
+    ref = np.array([myGTR.prob_t_profiles((profile_p, profile_ch), multiplicity, t, return_log=True)
+                    for t in t_grid])
+    print('testing grid evaluation of profile likelihoods')
+    grid = myGTR.prob_t_profiles_grid((profile_p, profile_ch), multiplicity, t_grid, return_log=True)
+    assert np.allclose(ref, grid, rtol=1e-10)
+
+    print('testing likelihood of rotated profiles')
+    non_gap_frac = (1-profile_p[:,myGTR.gap_index])*(1-profile_ch[:,myGTR.gap_index])
+    rotated_product = (myGTR.rotate_profile_inv(profile_p)*myGTR.rotate_profile(profile_ch)).T
+    rotated = np.array([myGTR.prob_t_rotated_profiles(rotated_product, multiplicity*non_gap_frac, t, return_log=True)
+                        for t in t_grid])
+    assert np.allclose(ref, rotated, rtol=1e-10)
+
+
 def test_ancestral():
     import os
     from Bio import AlignIO
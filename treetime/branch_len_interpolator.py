@@ -78,11 +78,9 @@ class BranchLenInterpolator (Distribution):
                                              100 + np.abs([(mutation_length-k)/sigma for k in grid])], axis=0))
         elif branch_length_mode=='marginal':
             if hasattr(node, 'profile_pair'):
-                log_prob = np.array([-self.gtr.prob_t_profiles(node.profile_pair,
-                                                        pattern_multiplicity,
-                                                        k,
-                                                        return_log=True)
-                                    for k in grid])
+                log_prob = -self.gtr.prob_t_profiles_grid(node.profile_pair,
+                                                          pattern_multiplicity,
+                                                          grid, return_log=True)
             else:
                 raise Exception("profile pairs need to be assigned to node")
 
@@ -91,11 +89,9 @@ class BranchLenInterpolator (Distribution):
             if not hasattr(node, 'branch_state'):
                 raise Exception("branch state pairs need to be assigned to nodes")
 
-            log_prob = np.array([-self.gtr.prob_t_compressed(node.branch_state['pair'],
-                                                    node.branch_state['multiplicity'],
-                                                    k,
-                                                    return_log=True)
-                                for k in grid])
+            log_prob = -self.gtr.prob_t_compressed_grid(node.branch_state['pair'],
+                                                        node.branch_state['multiplicity'],
+                                                        grid, return_log=True)
         else:
             raise Exception("unknown branch length mode! "+branch_length_mode)
         # tmp_dis = Distribution(grid, log_prob, is_log=True, kind='linear')
@@ -626,7 +626,8 @@ class ClockTree(TreeAnc):
                         plt.plot(msg_parent_to_node.x,msg_parent_to_node.y-msg_parent_to_node.peak_val, '-o')
                         plt.ylim(0,100)
                         plt.xlim(-0.05, 0.05)
-                        import ipdb; ipdb.set_trace()
+                        self.logger("WARNING: ClockTree._ml_t_root_to_leaves: message from parent to node %s"
+                                    " has %d sign changes, the convolution may be inaccurate"%(node.name, nsign_changed), 2, warn=True)
 
             # assign positions of nodes and branch length only when desired
             # since marginal reconstruction can result in negative branch length
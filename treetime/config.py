@@ -29,6 +29,7 @@ MIN_INTEGRATION_PEAK = 0.001
 # clocktree parameters
 BRANCH_LEN_PENALTY = 0
 MAX_BRANCH_LENGTH = 4.0          # only relevant for branch length optimization and time trees - upper boundary of interpolator objects
+EXPQT_CACHE_SIZE = 1000          # maximal number of exponentiated rate matrices a GTR model keeps for reuse
 NINTEGRAL = 300
 REL_TOL_PRUNE = 0.01
 REL_TOL_REFINE = 0.05
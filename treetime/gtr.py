@@ -1,5 +1,4 @@
 from __future__ import division, print_function, absolute_import
-from collections import defaultdict
 import numpy as np
 from . import config as ttconf
 from .seq_utils import alphabets, profile_maps, alphabet_synonyms
@@ -80,6 +79,7 @@ class GTR(object):
         self.logger("GTR: init with dummy values!", 3)
         self.v = None # right eigenvectors
         self.v_inv = None # left eigenvectors
+        self.v_inv_T = None # transposed left eigenvectors, used to rotate profiles
         self.eigenvals = None # eigenvalues
         self.assign_rates()
 
@@ -214,9 +214,8 @@ class GTR(object):
             np.fill_diagonal(W, 0.0)
             np.fill_diagonal(W, - W.sum(axis=0))
         else:
-            W=np.array(W)
+            W=0.5*(W+W.T) # symmetrize once, the eigendecomposition assumes a symmetric W
 
-        self._W = 0.5*(W+W.T)
         np.fill_diagonal(W,0)
         average_rate = avg_transition(W, self.Pi, gap_index=self.gap_index)
         self._W = W/average_rate
@@ -426,7 +425,10 @@ class GTR(object):
         gtr = cls(alphabet)
         n = gtr.alphabet.shape[0]
         pi = 1.0*np.random.randint(0,100,size=(n))
-        W = 1.0*np.random.randint(0,100,size=(n,n)) # with gaps
+        # draw the lower triangle only and mirror it, W is symmetric with zero diagonal
+        tmp = np.zeros((n,n))
+        tmp[np.tril_indices(n,k=-1)] = np.random.randint(0,100,size=n*(n-1)//2)
+        W = tmp + tmp.T # with gaps
 
         gtr.assign_rates(mu=mu, pi=pi, W=W)
         return gtr
@@ -541,6 +543,8 @@ class GTR(object):
         and hence to speed-up the computations.
         """
         self.eigenvals, self.v, self.v_inv = self._eig_single_site(self.W, self.Pi)
+        self.v_inv_T = np.ascontiguousarray(self.v_inv.T)
+        self._expQt_cache = {} # exponentiated rate matrices keyed by time, invalid after re-diagonalization
 
 
     def _eig_single_site(self, W, p):
@@ -560,7 +564,11 @@ class GTR(object):
         eigvals, eigvecs = np.linalg.eigh(symQ)
         tmp_v = eigvecs.T*tmpp
         one_norm = np.sum(np.abs(tmp_v), axis=1)
-        return eigvals, tmp_v.T/one_norm, (eigvecs*one_norm).T/tmpp
+        # the eigenvectors of symQ are orthonormal, hence the left eigenvectors follow
+        # without matrix inversion. Both are returned as C-contiguous arrays since they
+        # are multiplied with profiles in many places.
+        return (eigvals, np.ascontiguousarray(tmp_v.T/one_norm, dtype=float),
+                np.ascontiguousarray((eigvecs*one_norm).T/tmpp, dtype=float))
 
 
     def state_pair(self, seq_p, seq_ch, pattern_multiplicity=None,
@@ -602,43 +610,29 @@ class GTR(object):
         if pattern_multiplicity is None:
             pattern_multiplicity = np.ones_like(seq_p, dtype=float)
 
-        from collections import Counter
         if seq_ch.shape != seq_p.shape:
             raise ValueError("GTR.state_pair: Sequence lengths do not match!")
 
-        if len(self.alphabet)<10: # for small alphabet, repeatedly check array for all state pairs
-            pair_count = []
-            bool_seqs_p = []
-            bool_seqs_ch = []
-            for seq, bs in [(seq_p,bool_seqs_p), (seq_ch, bool_seqs_ch)]:
-                for ni,nuc in enumerate(self.alphabet):
-                    bs.append(seq==nuc)
-
-            for n1,nuc1 in enumerate(self.alphabet):
-                if (self.gap_index is None) or (not ignore_gaps) or (n1!=self.gap_index):
-                    for n2,nuc2 in enumerate(self.alphabet):
-                        if (self.gap_index is None) or (not ignore_gaps) or (n2!=self.gap_index):
-                            count = ((bool_seqs_p[n1]&bool_seqs_ch[n2])*pattern_multiplicity).sum()
-                            if count: pair_count.append(((n1,n2), count))
-        else: # enumerate state pairs of the sequence for large alphabets
-            num_seqs = []
-            for seq in [seq_p, seq_ch]: # for each sequence (parent and child) construct a numerical sequence [0,5,3,1,2,3...]
-                tmp = np.ones_like(seq, dtype=int)
-                for ni,nuc in enumerate(self.alphabet):
-                    tmp[seq==nuc] = ni  # set each position corresponding to a state to the corresponding index
-                num_seqs.append(tmp)
-            pair_count = defaultdict(int)
-            if ignore_gaps:  # if gaps are ignored skip positions where one or the other sequence is gapped
-                for i in range(len(seq_p)):
-                    if self.gap_index!=num_seqs[0][i] and self.gap_index!=num_seqs[1][i]:
-                        pair_count[(num_seqs[0][i],num_seqs[1][i])]+=pattern_multiplicity[i]
-            else: # otherwise, just count
-                for i in range(len(seq_p)):
-                    pair_count[(num_seqs[0][i],num_seqs[1][i])]+=pattern_multiplicity[i]
-            pair_count = pair_count.items()
-
-        return (np.array([x[0] for x in pair_count], dtype=int),    # [(child_nuc, parent_nuc),()...]
-                np.array([x[1] for x in pair_count], dtype=int))    # multiplicity of each parent/child nuc pair
+        n_states = len(self.alphabet)
+        num_seqs = []
+        for seq in [seq_p, seq_ch]: # for each sequence (parent and child) construct a numerical sequence [0,5,3,1,2,3...]
+            tmp = -np.ones_like(seq, dtype=int) # characters not in the alphabet are flagged by -1
+            for ni,nuc in enumerate(self.alphabet):
+                tmp[seq==nuc] = ni  # set each position corresponding to a state to the corresponding index
+            num_seqs.append(tmp)
+
+        valid = (num_seqs[0]>=0)&(num_seqs[1]>=0)
+        if ignore_gaps and (self.gap_index is not None): # skip positions where one or the other sequence is gapped
+            valid &= (num_seqs[0]!=self.gap_index)&(num_seqs[1]!=self.gap_index)
+
+        # encode each parent/child pair as a single integer and count all pairs in one pass
+        pair_index = num_seqs[0][valid]*n_states + num_seqs[1][valid]
+        pair_count = np.bincount(pair_index, weights=pattern_multiplicity[valid],
+                                 minlength=n_states**2)
+        observed_pairs = np.nonzero(pair_count)[0]
+
+        return (np.array([observed_pairs//n_states, observed_pairs%n_states], dtype=int).T, # [(child_nuc, parent_nuc),()...]
+                pair_count[observed_pairs].astype(int))    # multiplicity of each parent/child nuc pair
 
 
 ########################################################################
@@ -671,11 +665,47 @@ class GTR(object):
         if t<0:
             logP = -ttconf.BIG_NUMBER
         else:
-            tmp_eQT = self.expQt(t)
-            bad_indices=(tmp_eQT==0)
-            logQt = np.log(tmp_eQT + ttconf.TINY_NUMBER*(bad_indices))
-            logQt[np.isnan(logQt) | np.isinf(logQt) | bad_indices] = -ttconf.BIG_NUMBER
-            logP = np.sum(logQt[seq_pair[:,1], seq_pair[:,0]]*multiplicity)
+            # only take the log of transition probabilities of observed state pairs.
+            # transitions with vanishing probability are assigned log-probability -BIG_NUMBER
+            Qt_pairs = self.expQt(t)[seq_pair[:,1], seq_pair[:,0]]
+            logQt = np.log(Qt_pairs, out=np.full(Qt_pairs.shape, -ttconf.BIG_NUMBER), where=Qt_pairs>0)
+            logP = logQt.dot(multiplicity)
+
+        return logP if return_log else np.exp(logP)
+
+
+    def prob_t_compressed_grid(self, seq_pair, multiplicity, t_grid, return_log=False):
+        '''
+        Calculate the probability of observing a sequence pair for an array of
+        distances at once, for compressed sequences. This is equivalent to calling
+        prob_t_compressed for each element of t_grid.
+
+        Parameters
+        ----------
+
+          seq_pair : numpy array
+            :code:`np.array([(0,1), (2,2), ()..])` as indicies of
+            pairs of aligned positions. (e.g. 'A'==0, 'C'==1 etc).
+
+          multiplicity : numpy array
+            The number of times a parent-child state pair is observed.
+
+          t_grid : numpy array
+            Lengths of the branch separating parent and child
+
+          return_log : bool
+            Whether or not to exponentiate the result
+
+        '''
+        if self.is_site_specific:
+            return np.array([self.prob_t_compressed(seq_pair, multiplicity, t, return_log=return_log)
+                             for t in t_grid])
+
+        t_grid = np.asarray(t_grid, dtype=float)
+        Qt_pairs = self.expQt_grid(np.maximum(t_grid, 0))[:, seq_pair[:,1], seq_pair[:,0]]
+        logQt = np.log(Qt_pairs, out=np.full(Qt_pairs.shape, -ttconf.BIG_NUMBER), where=Qt_pairs>0)
+        logP = logQt.dot(multiplicity)
+        logP[t_grid<0] = -ttconf.BIG_NUMBER
 
         return logP if return_log else np.exp(logP)
 
@@ -772,6 +802,21 @@ class GTR(object):
             depend on the value of :profiles:.
 
         """
+        if not profiles and np.all(seq_pair[:,0]==seq_pair[:,1]):
+            # without any change of state, the likelihood decreases monotonically
+            # with the branch length and the optimum is at zero.
+            return 0.0
+
+        rotated = profiles and not self.is_site_specific
+        if rotated:
+            # rotate the profiles into the eigenspace of the rate matrix once, rather
+            # than with every evaluation of the objective function below
+            profile_p, profile_ch = seq_pair
+            if self.gap_index is not None: # weigh each pattern by the probability that neither end is gapped
+                multiplicity = multiplicity*(1-profile_p[:,self.gap_index])*(1-profile_ch[:,self.gap_index])
+            # only the elementwise product of the rotated profiles enters the likelihood. It is
+            # stored as (a x L) array such that each eigen-component is contiguous in memory
+            seq_pair = np.ascontiguousarray((self.rotate_profile_inv(profile_p)*self.rotate_profile(profile_ch)).T)
 
         def _neg_prob(t, seq_pair, multiplicity):
             """
@@ -796,7 +841,10 @@ class GTR(object):
                 Negative probability of the two given sequences
                 to be separated by the time t.
             """
-            if profiles:
+            if rotated:
+                res = -1.0*self.prob_t_rotated_profiles(seq_pair, multiplicity,t**2, return_log=True)
+                return res + np.exp(t**4/10000)
+            elif profiles:
                 res = -1.0*self.prob_t_profiles(seq_pair, multiplicity,t**2, return_log=True)
                 return res + np.exp(t**4/10000)
             else:
@@ -867,9 +915,151 @@ class GTR(object):
             if ignore_gaps and (self.gap_index is not None): # calculate the probability that neither outgroup/node has a gap
                 non_gap_frac = (1-profile_pair[0][:,self.gap_index])*(1-profile_pair[1][:,self.gap_index])
                 # weigh log LH by the non-gap probability
-                logP = np.sum(multiplicity*np.log(res+ttconf.SUPERTINY_NUMBER)*non_gap_frac)
+                logP = (multiplicity*non_gap_frac).dot(np.log(res+ttconf.SUPERTINY_NUMBER))
             else:
-                logP = np.sum(multiplicity*np.log(res+ttconf.SUPERTINY_NUMBER))
+                logP = multiplicity.dot(np.log(res+ttconf.SUPERTINY_NUMBER))
+
+        return logP if return_log else np.exp(logP)
+
+
+    def prob_t_profiles_grid(self, profile_pair, multiplicity, t_grid,
+                             return_log=False, ignore_gaps=True):
+        '''
+        Calculate the probability of observing a node pair for an array of
+        distances at once. This is equivalent to calling prob_t_profiles for
+        each element of t_grid, but evaluates all distances in a few matrix
+        products rather than one Python call per distance.
+
+        Parameters
+        ----------
+
+          profile_pair: numpy arrays
+            Probability distributions of the nucleotides at either
+            end of the branch. pp[0] = parent, pp[1] = child
+
+          multiplicity : numpy array
+            The number of times an alignment pattern is observed
+
+          t_grid : numpy array
+            Lengths of the branch separating parent and child
+
+          ignore_gaps: bool
+            If True, ignore mutations to and from gaps in distance calculations
+
+          return_log : bool
+            Whether or not to exponentiate the result
+
+        '''
+        if self.is_site_specific:
+            return np.array([self.prob_t_profiles(profile_pair, multiplicity, t,
+                                                  return_log=return_log, ignore_gaps=ignore_gaps)
+                             for t in t_grid])
+
+        t_grid = np.asarray(t_grid, dtype=float)
+        profile_p, profile_ch = profile_pair
+        Qt = self.expQt_grid(np.maximum(t_grid, 0))
+        # accumulate res[t,a] = sum_ij profile_ch[a,i] Qt[t,i,j] profile_p[a,j] one parent
+        # state at a time. this avoids a (T x L x a) intermediate.
+        res = np.zeros((len(t_grid), profile_p.shape[0]))
+        for j in range(profile_p.shape[1]):
+            res += Qt[:,:,j].dot(profile_ch.T)*profile_p[:,j]
+
+        res += ttconf.SUPERTINY_NUMBER
+        np.log(res, out=res)
+        if ignore_gaps and (self.gap_index is not None): # weigh log LH by the non-gap probability
+            non_gap_frac = (1-profile_p[:,self.gap_index])*(1-profile_ch[:,self.gap_index])
+            logP = res.dot(multiplicity*non_gap_frac)
+        else:
+            logP = res.dot(multiplicity)
+        logP[t_grid<0] = -ttconf.BIG_NUMBER
+
+        return logP if return_log else np.exp(logP)
+
+
+    def rotate_profile(self, profile):
+        """
+        Rotate a profile into the eigenspace of the rate matrix using the
+        right eigenvectors. This is the representation of the child profile
+        that enters prob_t_rotated_profiles.
+
+        Parameters
+        ----------
+
+         profile : numpy.array
+            Sequence profile. Shape = (L, a),
+            where L - sequence length, a - alphabet size.
+
+        Returns
+        -------
+
+         res : numpy.array
+            Rotated profile, profile.dot(v). Shape = (L, a)
+
+        """
+        return profile.dot(self.v)
+
+
+    def rotate_profile_inv(self, profile):
+        """
+        Rotate a profile into the eigenspace of the rate matrix using the
+        left eigenvectors. This is the representation of the parent profile
+        that enters prob_t_rotated_profiles.
+
+        Parameters
+        ----------
+
+         profile : numpy.array
+            Sequence profile. Shape = (L, a),
+            where L - sequence length, a - alphabet size.
+
+        Returns
+        -------
+
+         res : numpy.array
+            Rotated profile, profile.dot(v_inv.T). Shape = (L, a)
+
+        """
+        return profile.dot(self.v_inv_T)
+
+
+    def prob_t_rotated_profiles(self, rotated_product, multiplicity, t, return_log=False):
+        '''
+        Calculate the probability of observing a node pair at a distance t,
+        for profiles that have already been rotated into the eigenspace of
+        the rate matrix. This avoids recomputing the rotation when the
+        probability is evaluated repeatedly for the same pair of profiles.
+
+        Parameters
+        ----------
+
+          rotated_product: numpy array
+            Elementwise product of the rotated probability distributions at
+            either end of the branch, i.e.
+            (rotate_profile_inv(profile_p)*rotate_profile(profile_ch)).T
+            Shape = (a, L), where L - number of patterns, a - alphabet size.
+
+          multiplicity : numpy array
+            The number of times an alignment pattern is observed, possibly
+            weighted by the probability that neither end is gapped
+
+          t : float
+            Length of the branch separating parent and child
+
+          return_log : bool
+            Whether or not to exponentiate the result
+
+        '''
+        if t<0:
+            logP = -ttconf.BIG_NUMBER
+        else:
+            # a single matrix-vector product streaming over contiguous rows of length L.
+            # This is independent of the alphabet size; accumulating the a rows one by one
+            # (an unrolled kernel for nucleotides) is several times slower than BLAS gemv.
+            res = self._exp_lt(t).dot(rotated_product)
+            # clip rounding errors in place and accumulate in log-space to avoid underflow
+            np.maximum(res, 0, out=res)
+            res += ttconf.SUPERTINY_NUMBER
+            logP = multiplicity.dot(np.log(res, out=res))
 
         return logP if return_log else np.exp(logP)
 
@@ -968,11 +1158,38 @@ class GTR(object):
         --------
 
          expQt : numpy.array
-            Matrix exponential of exo(Qt)
+            Matrix exponential of exo(Qt). The matrix is cached for repeated
+            calls with the same t and hence returned as read-only array.
+        '''
+        if t in self._expQt_cache:
+            return self._expQt_cache[t]
+
+        # scale the columns of v by exp(lambda*t) rather than multiplying with a diagonal matrix
+        Qs = np.maximum(0, (self.v*self._exp_lt(t)).dot(self.v_inv))   # This is P(nuc1 | given nuc_2)
+        Qs.flags.writeable = False
+        if len(self._expQt_cache)>=ttconf.EXPQT_CACHE_SIZE:
+            self._expQt_cache.clear()
+        self._expQt_cache[t] = Qs
+        return Qs
+
+
+    def expQt_grid(self, t_grid):
+        '''
+        Parameters
+        ----------
+
+         t_grid : numpy.array
+            Array of times to propagate
+
+        Returns
+        --------
+
+         expQt : numpy.array
+            Stack of matrix exponentials exp(Qt), one for each time in
+            t_grid. Shape = (T, a, a). These are not cached.
         '''
-        eLambdaT = np.diag(self._exp_lt(t)) # vector length = a
-        Qs = self.v.dot(eLambdaT.dot(self.v_inv))   # This is P(nuc1 | given nuc_2)
-        return np.maximum(0,Qs)
+        eLambdaT = np.exp(self.mu*np.outer(t_grid, self.eigenvals)) # shape (T, a)
+        return np.maximum(0, np.einsum('ik,tk,kj->tij', self.v, eLambdaT, self.v_inv))
 
 
     def expQs(self, s):
@@ -986,8 +1203,8 @@ class GTR(object):
         Qtds :  Returns 2 V_{ij} \lambda_j s e^{\lambda_j s**2 } V^{-1}_{jk}
                 This is the derivative of the branch probability with respect to s=\sqrt(t)
         '''
-        lambda_eLambdaT = np.diag(2.0*self._exp_lt(s**2)*self.eigenvals*s)
-        return self.v.dot(lambda_eLambdaT.dot(self.v_inv))
+        lambda_eLambdaT = 2.0*self._exp_lt(s**2)*self.eigenvals*s # vector length = a
+        return (self.v*lambda_eLambdaT).dot(self.v_inv)
 
 
     def sequence_logLH(self,seq, pattern_multiplicity=None):
@@ -1015,7 +1232,7 @@ class GTR(object):
         return self.mu*avg_transition(self.W, self.Pi, gap_index=self.gap_index)
 
     def save_to_npz(self, outfile):
-        full_gtr = self.mu * np.dot(self.Pi, self.W)
+        full_gtr = self.mu * self.Pi[:,None] * self.W
         desc=np.array(["GTR matrix description\n", "Substitution rate: " + str(self.mu)])
         np.savez(outfile,   description=desc,
                             full_gtr=full_gtr,
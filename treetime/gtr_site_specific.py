@@ -298,21 +298,32 @@ class GTR_site_specific(GTR):
 
 
     def _eig(self):
-        eigvals, vec, vec_inv = [], [], []
-        for pi in range(self.seq_len):
-            if len(self.W.shape)>2:
-                W = np.copy(self.W[:,:,pi])
-                np.fill_diagonal(W, 0)
-            elif pi==0:
-                np.fill_diagonal(self.W, 0)
-                W=self.W
-
-            ev, evec, evec_inv = self._eig_single_site(W,self.Pi[:,pi])
-            eigvals.append(ev)
-            vec.append(evec)
-            vec_inv.append(evec_inv)
-
-        self.eigenvals = np.array(eigvals).T
+        """
+        Perform the eigendecomposition of the rate matrices of all sites at once.
+        This follows GTR._eig_single_site, but diagonalizes the stack of symmetrized
+        rate matrices with a single call to np.linalg.eigh rather than site by site.
+        """
+        n = len(self.alphabet)
+        diag = np.arange(n)
+        if len(self.W.shape)>2:
+            W = np.moveaxis(self.W, -1, 0).copy() # shape (L, n, n)
+            W[:, diag, diag] = 0
+        else:
+            np.fill_diagonal(self.W, 0)
+            W = self.W
+
+        p = self.Pi.T # shape (L, n)
+        tmpp = np.sqrt(p)
+        symQ = W*tmpp[:,:,None]*tmpp[:,None,:]
+        symQ[:, diag, diag] = -np.sum(W*p[:,None,:], axis=-1)
+
+        eigvals, eigvecs = np.linalg.eigh(symQ)
+        tmp_v = np.swapaxes(eigvecs, 1, 2)*tmpp[:,None,:]
+        one_norm = np.sum(np.abs(tmp_v), axis=-1)
+        vec = np.swapaxes(tmp_v, 1, 2)/one_norm[:,None,:]
+        vec_inv = np.swapaxes(eigvecs*one_norm[:,None,:], 1, 2)/tmpp[:,None,:]
+
+        self.eigenvals = eigvals.T
         self.v = np.swapaxes(vec,0,-1)
         self.v_inv = np.swapaxes(vec_inv, 0,-1)
 
@@ -326,7 +337,10 @@ class GTR_site_specific(GTR):
                                                      np.linspace(.1,1,21)[:-1],
                                                      np.linspace(1,5,21)[:-1],
                                                      np.linspace(5,10,11)))
-        stacked_expQT = np.stack([self._expQt(t) for t in t_grid], axis=0)
+        # evaluate the matrix exponentials at all grid points in a single tensor
+        # contraction rather than one call to _expQt per time point
+        eLambdaT = np.exp(t_grid[:,None,None]*self.mu*self.eigenvals)
+        stacked_expQT = np.einsum('jia,tja,kja->tika', self.v, eLambdaT, self.v_inv, optimize=True)
 
         from scipy.interpolate import interp1d
         self.expQt_interpolator = interp1d(t_grid, stacked_expQT, axis=0,
@@ -358,6 +372,42 @@ class GTR_site_specific(GTR):
             return self._expQt(t)
 
 
+    def rotate_profile(self, profile):
+        """
+        Rotate a profile into the eigenspace of the rate matrix of each site
+        using the right eigenvectors.
+
+        Parameters
+        ----------
+        profile : numpy.array
+            Sequence profile. Shape = (L, a)
+
+        Returns
+        -------
+        numpy.array
+            Rotated profile. Shape = (L, a)
+        """
+        return np.einsum('ai,jia->aj', profile, self.v)
+
+
+    def rotate_profile_inv(self, profile):
+        """
+        Rotate a profile into the eigenspace of the rate matrix of each site
+        using the left eigenvectors.
+
+        Parameters
+        ----------
+        profile : numpy.array
+            Sequence profile. Shape = (L, a)
+
+        Returns
+        -------
+        numpy.array
+            Rotated profile. Shape = (L, a)
+        """
+        return np.einsum('aj,jka->ak', profile, self.v_inv)
+
+
     def prop_t_compressed(self, seq_pair, multiplicity, t, return_log=False):
         print("NOT IMPEMENTED")
 
@@ -464,19 +514,21 @@ class GTR_site_specific(GTR):
             logP = -ttconf.BIG_NUMBER
         else:
             tmp_eQT = self.expQt(t)
-            bad_indices=(tmp_eQT==0)
-            logQt = np.log(tmp_eQT + ttconf.TINY_NUMBER*(bad_indices))
-            logQt[np.isnan(logQt) | np.isinf(logQt) | bad_indices] = -ttconf.BIG_NUMBER
             seq_indices_c = np.zeros(len(seq_ch), dtype=int)
             seq_indices_p = np.zeros(len(seq_p), dtype=int)
             for ai, a in enumerate(self.alphabet):
                 seq_indices_p[seq_p==a] = ai
                 seq_indices_c[seq_ch==a] = ai
 
-            if len(logQt.shape)==2:
-                logP = np.sum(logQt[seq_indices_p, seq_indices_c]*pattern_multiplicity)
+            # only take the log of the transition probabilities along the sequence rather
+            # than of the full stack of matrices.
+            if len(tmp_eQT.shape)==2:
+                Qt_seq = tmp_eQT[seq_indices_p, seq_indices_c]
             else:
-                logP = np.sum(logQt[seq_indices_p, seq_indices_c, np.arange(len(seq_ch))]*pattern_multiplicity)
+                Qt_seq = tmp_eQT[seq_indices_p, seq_indices_c, np.arange(len(seq_ch))]
+            # transitions with vanishing probability are assigned log-probability -BIG_NUMBER
+            logQt = np.log(Qt_seq, out=np.full(Qt_seq.shape, -ttconf.BIG_NUMBER), where=Qt_seq>0)
+            logP = np.sum(logQt*pattern_multiplicity)
 
         return logP if return_log else np.exp(logP)
 
@@ -216,8 +216,10 @@ def seq2prof(seq, profile_map):
         Profile for the character. Zero array if the character not found
 
     """
-
-    return np.array([profile_map[k] for k in seq])
+    # look up the profile of each distinct character only once and
+    # assemble the (L x a) float profile by fancy indexing
+    chars, char_index = np.unique(seq, return_inverse=True)
+    return np.array([profile_map[k] for k in chars], dtype=float)[char_index]
 
 
 def prof2seq(profile, gtr, sample_from_prof=False, normalize=True):